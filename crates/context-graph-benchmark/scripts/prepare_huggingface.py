@@ -16,16 +16,35 @@ Usage:
 
 Environment:
     HF_TOKEN: HuggingFace API token for authenticated access
+
+Cache:
+    The text, title and topic fields of every document read are kept under
+    <output>/.hf_cache (up to max_docs documents per dataset, roughly the
+    size of the text in chunks.jsonl) so later runs need not re-fetch them.
+    Delete the directory to reclaim the space; --no-cache disables it.
+
+Optional:
+    orjson: faster JSON serialization (pip install orjson); falls back to
+    the stdlib json module when unavailable.
+    zstandard: required for --compress (pip install zstandard).
+    pyarrow: required for --format parquet (pip install pyarrow).
 """
 
 import argparse
 import hashlib
+import itertools
 import json
 import os
+import queue
+import shutil
+import signal
 import sys
+import threading
+from collections import Counter
 from dataclasses import dataclass, field
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, Iterator, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Check for required packages
 try:
@@ -37,6 +56,23 @@ except ImportError as e:
     print("Install with: pip install datasets huggingface_hub tqdm")
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 
 @dataclass
 class DatasetConfig:
@@ -50,12 +86,29 @@ class DatasetConfig:
     title_field: Optional[str] = None
     topic_field: Optional[str] = None
     max_docs: int = 5000
+    max_chunks: Optional[int] = None  # Per-dataset chunk budget
     min_words: int = 50
     trust_remote_code: bool = False
     # Field mapping for normalization
     field_transforms: Dict[str, str] = field(default_factory=dict)
 
 
+# Records serialized per write() call; bounds the size of each joined buffer
+WRITE_BATCH_SIZE = 10000
+
+# zstd level for --compress output; multithreaded across all cores
+ZSTD_LEVEL = 3
+
+# Columns of chunks.parquet stored dictionary-encoded: a doc_id repeats for
+# every chunk of its document, topic_hint and source_dataset across datasets
+PARQUET_DICTIONARY_COLUMNS = ["doc_id", "topic_hint", "source_dataset"]
+
+# Documents fetched ahead of the chunking loop by the prefetch thread
+PREFETCH_BUFFER = 64
+
+# Local copies of streamed documents, reused instead of re-fetching
+DOC_CACHE_DIR = ".hf_cache"
+
 # Dataset configurations
 DATASET_CONFIGS = [
     DatasetConfig(
@@ -101,81 +154,392 @@ DATASET_CONFIGS = [
 ]
 
 
+def dumps_record(record: dict) -> bytes:
+    """Serialize a record as a single newline-terminated JSONL line."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+def dumps_pretty(obj: dict) -> bytes:
+    """Serialize an object as indented JSON (for metadata files)."""
+    if orjson is not None:
+        # Topic keys may be ints (list-of-int labels); json.dumps stringifies them
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode()
+
+
+def loads_json(data: bytes):
+    """Deserialize a JSON document (one JSONL line or a metadata file)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def open_output(path: Path, compress: bool = False) -> BinaryIO:
+    """Open an output file for binary writing, zstd-compressed if requested."""
+    f = open(path, "wb")
+    if compress:
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).stream_writer(f)
+    return f
+
+
+def write_records(f, records: List[dict]) -> None:
+    """Write records as JSONL, joining each batch into a single write() call."""
+    for i in range(0, len(records), WRITE_BATCH_SIZE):
+        batch = records[i : i + WRITE_BATCH_SIZE]
+        f.write(b"".join(dumps_record(r) for r in batch))
+
+
+def chunk_parquet_schema() -> "pa.Schema":
+    """Arrow schema of chunks.parquet, matching the JSONL chunk records."""
+    columns = [
+        ("id", pa.string()),
+        ("doc_id", pa.string()),
+        ("title", pa.string()),
+        ("chunk_idx", pa.int64()),
+        ("text", pa.string()),
+        ("word_count", pa.int64()),
+        ("start_word", pa.int64()),
+        ("end_word", pa.int64()),
+        ("topic_hint", pa.string()),
+        ("source_dataset", pa.string()),
+    ]
+    return pa.schema(
+        (name, pa.dictionary(pa.int32(), pa.string()))
+        if name in PARQUET_DICTIONARY_COLUMNS
+        else (name, type_)
+        for name, type_ in columns
+    )
+
+
+def write_parquet(shards: Iterable[Path], path: Path) -> None:
+    """
+    Convert JSONL chunk shards, in order, into a zstd-compressed Parquet file.
+
+    Non-string values in string columns (such as int topic labels) are
+    written as strings. The file is written under a temporary name and only
+    moved into place once complete.
+    """
+    schema = chunk_parquet_schema()
+    string_columns = {
+        f.name
+        for f in schema
+        if f.type == pa.string() or pa.types.is_dictionary(f.type)
+    }
+    partial = path.with_name(path.name + ".partial")
+    try:
+        with pq.ParquetWriter(
+            partial,
+            schema,
+            compression="zstd",
+            use_dictionary=PARQUET_DICTIONARY_COLUMNS,
+        ) as writer:
+            columns: Dict[str, list] = {name: [] for name in schema.names}
+            rows = 0
+            for shard in shards:
+                with open(shard, "rb") as f:
+                    for line in f:
+                        record = loads_json(line)
+                        for name, values in columns.items():
+                            value = record[name]
+                            if name in string_columns and not isinstance(value, str):
+                                value = None if value is None else str(value)
+                            values.append(value)
+                        rows += 1
+                        if rows == WRITE_BATCH_SIZE:
+                            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                            columns = {name: [] for name in schema.names}
+                            rows = 0
+            if rows:
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    os.replace(partial, path)
+
+
+def prefetch_iter(iterable: Iterable, buffer: int = PREFETCH_BUFFER) -> Iterator:
+    """
+    Iterate over iterable while a background thread fetches items ahead.
+
+    Network reads and decoding of a streaming dataset then overlap with the
+    consumer's work. Exceptions raised while fetching are re-raised in the
+    consumer; closing the iterator early stops the thread.
+    """
+    items: queue.Queue = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+    end = object()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((end, e))
+            return
+        put((end, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def doc_cache_fields(config: DatasetConfig) -> List[str]:
+    """Document fields read by process_dataset, the only ones cached."""
+    return [
+        f for f in (config.text_field, config.title_field, config.topic_field) if f
+    ]
+
+
+def doc_cache_path(cache_dir: Path, config: DatasetConfig) -> Path:
+    """Path of the local copy of a dataset's leading documents."""
+    fields = ",".join(doc_cache_fields(config))
+    source = f"{config.hf_path}:{config.hf_subset}:{config.split}:{fields}"
+    digest = hashlib.sha256(source.encode()).hexdigest()[:12]
+    return cache_dir / f"{config.name}-{digest}.jsonl"
+
+
+def count_cached_docs(path: Path) -> int:
+    """Number of documents in a cache file (0 if it does not exist)."""
+    if not path.exists():
+        return 0
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+
+def iter_cached_docs(path: Path) -> Iterator[dict]:
+    """Yield documents from a cache file written by cache_docs."""
+    if not path.exists():
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            yield loads_json(line)
+
+
+def cache_docs(
+    docs: Iterable[dict], path: Path, fields: List[str], cached: int = 0
+) -> Iterator[dict]:
+    """
+    Yield docs unchanged while saving their given fields, in order, to a
+    cache file.
+
+    The cache is replaced when the iterator is closed, but only if more
+    documents were seen than the cached documents it already holds. Documents
+    that cannot be serialized disable caching for the rest of the stream.
+    """
+    partial = path.with_name(path.name + ".partial")
+    f = open(partial, "wb")
+    written = 0
+    try:
+        for doc in docs:
+            if f is not None:
+                try:
+                    f.write(dumps_record({k: doc[k] for k in fields if k in doc}))
+                    written += 1
+                except TypeError:
+                    f.close()
+                    f = None
+                    written = 0
+            yield doc
+    finally:
+        if f is not None:
+            f.close()
+        if written > cached:
+            os.replace(partial, path)
+        else:
+            partial.unlink(missing_ok=True)
+
+
+def stream_docs(config: DatasetConfig, skip: int = 0) -> Iterator[dict]:
+    """
+    Stream a dataset's documents from HuggingFace, starting after skip docs.
+
+    The dataset is only loaded once the first document is requested.
+    """
+    try:
+        # Load dataset with streaming
+        load_kwargs = {
+            "path": config.hf_path,
+            "split": config.split,
+            "streaming": True,
+            "trust_remote_code": config.trust_remote_code,
+        }
+        if config.hf_subset:
+            load_kwargs["name"] = config.hf_subset
+
+        dataset = load_dataset(**load_kwargs)
+
+    except Exception as e:
+        print(f"\n  Warning: Failed to load {config.name}: {e}")
+        return
+
+    yield from itertools.islice(dataset, skip, None)
+
+
 def chunk_text(
-    text: str, chunk_size: int = 200, overlap: int = 50
+    text: str,
+    chunk_size: int = 200,
+    overlap: int = 50,
+    words: Optional[List[str]] = None,
+    max_chunks: Optional[int] = None,
 ) -> List[Tuple[str, int, int]]:
     """
     Chunk text into overlapping segments of approximately chunk_size words.
 
+    Pass words if the caller has already split text, to avoid splitting again,
+    and max_chunks to stop after that many chunks.
     Returns list of (chunk_text, start_word_idx, end_word_idx) tuples.
     """
-    words = text.split()
-    if len(words) <= chunk_size:
-        return [(text, 0, len(words))]
+    if words is None:
+        words = text.split()
+    n_words = len(words)
+    if n_words <= chunk_size:
+        return [(text, 0, n_words)]
 
     chunks = []
+    step = chunk_size - overlap
     start = 0
-    while start < len(words):
-        end = min(start + chunk_size, len(words))
-        chunk_words = words[start:end]
-        chunk_text = " ".join(chunk_words)
-        chunks.append((chunk_text, start, end))
+    while start < n_words:
+        end = min(start + chunk_size, n_words)
+        chunks.append((" ".join(words[start:end]), start, end))
+        if max_chunks is not None and len(chunks) >= max_chunks:
+            break
 
         # Move forward by (chunk_size - overlap) words
-        start += chunk_size - overlap
+        start += step
 
         # Don't create tiny final chunks
-        if len(words) - start < overlap:
+        if n_words - start < overlap:
             break
 
     return chunks
 
 
-def generate_chunk_id(doc_id: str, chunk_idx: int, source: str) -> str:
-    """Generate a deterministic UUID-like ID for a chunk."""
-    content = f"{source}:{doc_id}:{chunk_idx}"
-    hash_bytes = hashlib.sha256(content.encode()).digest()[:16]
-    # Format as UUID
-    return f"{hash_bytes[:4].hex()}-{hash_bytes[4:6].hex()}-{hash_bytes[6:8].hex()}-{hash_bytes[8:10].hex()}-{hash_bytes[10:16].hex()}"
-
-
-def extract_topic(config: DatasetConfig, doc: dict) -> str:
-    """Extract topic/category from document based on config."""
-    if config.topic_field and config.topic_field in doc:
-        topic = doc[config.topic_field]
-        # Handle different formats
-        if isinstance(topic, list):
-            return topic[0] if topic else "unknown"
-        if isinstance(topic, str):
-            # For comma-separated tags (stackoverflow), take first
-            if "," in topic:
-                return topic.split(",")[0].strip().lower()
-            # For labels like "cs.AI", normalize
-            return topic.lower().replace(".", "_")
-        if isinstance(topic, int):
-            # Numeric label - convert to string
-            return f"label_{topic}"
-        return str(topic)
-
-    # Fallback: extract from title
-    if config.title_field and config.title_field in doc:
-        title = doc.get(config.title_field, "")
-        if title:
-            # Use first word of title as rough topic
-            return title.split()[0].lower()[:20]
-
-    return f"{config.name}_general"
+def format_chunk_id(hash_bytes: bytes) -> str:
+    """Format the first 16 bytes of a digest as a UUID string."""
+    h = hash_bytes[:16].hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def generate_chunk_ids(doc_id: str, num_chunks: int, source: str) -> List[str]:
+    """
+    Generate deterministic UUID-like IDs for all chunks of a document.
+
+    Each ID is the SHA-256 of "source:doc_id:chunk_idx"; the shared
+    "source:doc_id:" prefix is hashed once and the hasher state copied per
+    chunk.
+    """
+    prefix = hashlib.sha256(f"{source}:{doc_id}:".encode())
+    ids = []
+    for chunk_idx in range(num_chunks):
+        h = prefix.copy()
+        h.update(str(chunk_idx).encode())
+        ids.append(format_chunk_id(h.digest()))
+    return ids
+
+
+def topic_from_list(topic: list) -> str:
+    """Topic from a list of labels: the first one."""
+    return topic[0] if topic else "unknown"
+
+
+def topic_from_str(topic: str) -> str:
+    """Topic from a string label or comma-separated tag list."""
+    # For comma-separated tags (stackoverflow), take first
+    head, sep, _ = topic.partition(",")
+    if sep:
+        return head.strip().lower()
+    # For labels like "cs.AI", normalize
+    return topic.lower().replace(".", "_")
+
+
+def topic_from_int(topic: int) -> str:
+    """Topic from a numeric class label."""
+    return f"label_{topic}"
+
+
+# Topic normalizers keyed by the raw field type
+TOPIC_HANDLERS = {
+    list: topic_from_list,
+    str: topic_from_str,
+    int: topic_from_int,
+}
+
+
+def normalize_topic(topic) -> str:
+    """Normalize a raw topic field value with the handler for its type."""
+    # Subclasses (e.g. bool) use their base type's handler
+    handler = TOPIC_HANDLERS.get(type(topic))
+    if handler is None:
+        handler = next(
+            (TOPIC_HANDLERS[t] for t in type(topic).__mro__ if t in TOPIC_HANDLERS),
+            str,
+        )
+    return handler(topic)
+
+
+def topic_extractor(config: DatasetConfig) -> Callable[[dict], str]:
+    """
+    Build the per-document topic extractor for a dataset.
+
+    Field names are bound once here rather than read from config per document.
+    """
+    topic_field = config.topic_field
+    title_field = config.title_field
+    fallback = f"{config.name}_general"
+
+    def get_topic(doc: dict) -> str:
+        if topic_field and topic_field in doc:
+            return normalize_topic(doc[topic_field])
+
+        # Fallback: extract from title
+        if title_field and title_field in doc:
+            title = doc.get(title_field, "")
+            if title:
+                # Use first word of title as rough topic
+                return title.split()[0].lower()[:20]
+
+        return fallback
+
+    return get_topic
 
 
 def process_dataset(
     config: DatasetConfig,
-    output_chunks: List[dict],
-    topic_counts: Dict[str, int],
+    writer: BinaryIO,
+    topic_counts: Counter,
     pbar: tqdm,
     chunk_size: int = 200,
     overlap: int = 50,
+    cache_dir: Optional[Path] = None,
 ) -> Dict[str, int]:
-    """Process a single dataset and append chunks to output list."""
+    """
+    Process a single dataset, streaming chunk records to writer as JSONL.
+
+    Chunks are written as soon as each document is chunked, so memory use is
+    independent of the number of chunks produced. With cache_dir, streamed
+    documents are saved there and later runs needing no more than the cached
+    count read them locally instead of fetching from HuggingFace.
+    """
     stats = {
         "documents": 0,
         "chunks": 0,
@@ -183,117 +547,264 @@ def process_dataset(
         "skipped_short": 0,
         "skipped_empty": 0,
     }
+    doc_topics: List[str] = []
 
-    try:
-        # Load dataset with streaming
-        load_kwargs = {
-            "path": config.hf_path,
-            "split": config.split,
-            "streaming": True,
-            "trust_remote_code": config.trust_remote_code,
-        }
-        if config.hf_subset:
-            load_kwargs["name"] = config.hf_subset
-
-        dataset = load_dataset(**load_kwargs)
+    cache_file = doc_cache_path(cache_dir, config) if cache_dir else None
+    cached = 0
+    if cache_file:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cached = count_cached_docs(cache_file)
 
-    except Exception as e:
-        print(f"\n  Warning: Failed to load {config.name}: {e}")
-        return stats
+    remaining_docs = max(config.max_docs - cached, 0)
+    docs: Iterable[dict] = prefetch_iter(
+        itertools.islice(stream_docs(config, skip=cached), remaining_docs)
+    )
+    if cache_file:
+        # Serve cached documents first; the stream is only opened (and its
+        # prefetch thread started) once they run out
+        cached_docs = itertools.islice(iter_cached_docs(cache_file), config.max_docs)
+        docs = cache_docs(
+            itertools.chain(cached_docs, docs), cache_file, doc_cache_fields(config), cached
+        )
+
+    # Bind per-dataset settings once instead of per document
+    name = config.name
+    text_field = config.text_field
+    title_field = config.title_field
+    min_words = config.min_words
+    max_docs = config.max_docs
+    max_chunks = config.max_chunks
+    get_topic = topic_extractor(config)
+    step = chunk_size - overlap
+
+    pbar.set_description(f"Processing {name}")
+
+    for i, doc in enumerate(docs):
+        if i >= max_docs:
+            break
 
-    for i, doc in enumerate(dataset):
-        if i >= config.max_docs:
+        if max_chunks is not None and stats["chunks"] >= max_chunks:
             break
 
         pbar.update(1)
-        pbar.set_description(f"Processing {config.name}")
 
         # Get text content
-        text = doc.get(config.text_field, "")
+        text = doc.get(text_field, "")
         if not text or not isinstance(text, str):
             stats["skipped_empty"] += 1
             continue
 
         # Clean text
         text = text.strip()
-        words = text.split()
-
-        if len(words) < config.min_words:
+        if max_chunks is None:
+            remaining_chunks = None
+            words = text.split()
+        else:
+            # Only split as many words as the remaining chunk budget can use.
+            # One extra word keeps a truncated document out of chunk_text's
+            # single-chunk path, which returns the full text.
+            remaining_chunks = max_chunks - stats["chunks"]
+            max_words = max((remaining_chunks - 1) * step + chunk_size + 1, min_words)
+            words = text.split(None, max_words)
+            if len(words) > max_words:
+                # The last element is the unsplit remainder of the text
+                words.pop()
+
+        if len(words) < min_words:
             stats["skipped_short"] += 1
             continue
 
         # Get metadata
-        title = doc.get(config.title_field, f"{config.name}_{i}") or f"{config.name}_{i}"
-        doc_id = f"{config.name}_{i}"
-        topic = extract_topic(config, doc)
+        doc_id = f"{name}_{i}"
+        title = str(doc.get(title_field) or doc_id)[:200]  # Truncate long titles
+        topic = get_topic(doc)
 
         # Track topic
-        topic_counts[topic] = topic_counts.get(topic, 0) + 1
+        doc_topics.append(topic)
 
         # Chunk the document
-        chunks = chunk_text(text, chunk_size, overlap)
+        chunks = chunk_text(
+            text, chunk_size, overlap, words=words, max_chunks=remaining_chunks
+        )
 
+        chunk_ids = generate_chunk_ids(doc_id, len(chunks), name)
+
+        doc_records = []
         for chunk_idx, (chunk_text_content, start_word, end_word) in enumerate(chunks):
-            chunk_id = generate_chunk_id(doc_id, chunk_idx, config.name)
+            chunk_id = chunk_ids[chunk_idx]
+            word_count = end_word - start_word
 
             chunk_record = {
                 "id": chunk_id,
                 "doc_id": doc_id,
-                "title": str(title)[:200],  # Truncate long titles
+                "title": title,
                 "chunk_idx": chunk_idx,
                 "text": chunk_text_content,
-                "word_count": len(chunk_text_content.split()),
+                "word_count": word_count,
                 "start_word": start_word,
                 "end_word": end_word,
                 "topic_hint": topic,
-                "source_dataset": config.name,
+                "source_dataset": name,
             }
 
-            output_chunks.append(chunk_record)
+            doc_records.append(chunk_record)
             stats["chunks"] += 1
-            stats["words"] += len(chunk_text_content.split())
+            stats["words"] += word_count
 
+        write_records(writer, doc_records)
         stats["documents"] += 1
 
+    topic_counts.update(doc_topics)
     return stats
 
 
+def shard_path(output_dir: Path, dataset_name: str) -> Path:
+    """Path of the per-dataset chunk shard written by a worker."""
+    return output_dir / f"chunks.{dataset_name}.jsonl"
+
+
+def init_worker(lock) -> None:
+    """Pool initializer: share the tqdm lock and leave Ctrl-C to the parent."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tqdm.set_lock(lock)
+
+
+def process_dataset_worker(
+    args: Tuple[DatasetConfig, Path, int, int, int, Optional[Path]],
+) -> Tuple[str, Dict[str, int], Counter]:
+    """
+    Pool worker: process one dataset into its own shard file.
+
+    Returns (dataset_name, dataset_stats, topic_counts) for merging in the parent.
+    """
+    config, output_dir, position, chunk_size, overlap, cache_dir = args
+    topic_counts: Counter = Counter()
+
+    with open(shard_path(output_dir, config.name), "wb") as writer, tqdm(
+        total=config.max_docs, desc=config.name, unit="docs", position=position
+    ) as pbar:
+        dataset_stats = process_dataset(
+            config=config,
+            writer=writer,
+            topic_counts=topic_counts,
+            pbar=pbar,
+            chunk_size=chunk_size,
+            overlap=overlap,
+            cache_dir=cache_dir,
+        )
+
+    return config.name, dataset_stats, topic_counts
+
+
+def merge_topic_counts(
+    base: Counter, configs: List[DatasetConfig], dataset_topics: Dict[str, Counter]
+) -> Counter:
+    """
+    Merge per-dataset topic counts onto base in config order.
+
+    Merging in a fixed order keeps ties among the top topics independent of
+    which dataset worker finished first.
+    """
+    merged = Counter(base)
+    for config in configs:
+        if config.name in dataset_topics:
+            merged.update(dataset_topics[config.name])
+    return merged
+
+
 def save_checkpoint(
     output_dir: Path,
-    chunks: List[dict],
     metadata: dict,
     checkpoint_name: str = "checkpoint",
 ):
-    """Save checkpoint for resume capability."""
-    checkpoint_file = output_dir / f"{checkpoint_name}.jsonl"
-    metadata_file = output_dir / f"{checkpoint_name}_meta.json"
+    """
+    Save checkpoint for resume capability.
 
-    with open(checkpoint_file, "w") as f:
-        for chunk in chunks:
-            f.write(json.dumps(chunk) + "\n")
+    Chunk data lives in the per-dataset shard files; a dataset is only listed
+    in processed_datasets once its shard is complete.
+    """
+    metadata_file = output_dir / f"{checkpoint_name}_meta.json"
 
-    with open(metadata_file, "w") as f:
-        json.dump(metadata, f, indent=2)
+    with open(metadata_file, "wb") as f:
+        f.write(dumps_pretty(metadata))
 
 
-def load_checkpoint(output_dir: Path) -> Tuple[List[dict], dict, set]:
-    """Load checkpoint if exists. Returns (chunks, metadata, processed_datasets)."""
-    checkpoint_file = output_dir / "checkpoint.jsonl"
+def convert_legacy_checkpoint(output_dir: Path) -> None:
+    """
+    Split a checkpoint.jsonl written by earlier versions of this script into
+    per-dataset shards, recording its totals in the checkpoint metadata.
+    """
+    legacy_file = output_dir / "checkpoint.jsonl"
     metadata_file = output_dir / "checkpoint_meta.json"
 
-    if not checkpoint_file.exists() or not metadata_file.exists():
-        return [], {}, set()
+    if not legacy_file.exists():
+        return
+    if not metadata_file.exists():
+        print(f"Note: Ignoring {legacy_file} without checkpoint metadata")
+        legacy_file.unlink()
+        return
 
-    chunks = []
-    with open(checkpoint_file) as f:
-        for line in f:
-            chunks.append(json.loads(line))
+    print(f"Converting {legacy_file} into per-dataset shards...")
+    with open(metadata_file, "rb") as f:
+        metadata = loads_json(f.read())
+
+    shards: Dict[str, BinaryIO] = {}
+    total_chunks = 0
+    total_words = 0
+    try:
+        with open(legacy_file, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = loads_json(line)
+                name = record["source_dataset"]
+                if name not in shards:
+                    shards[name] = open(shard_path(output_dir, name), "wb")
+                shards[name].write(dumps_record(record))
+                total_chunks += 1
+                total_words += record.get("word_count", 0)
+    finally:
+        for shard in shards.values():
+            shard.close()
+
+    # Processed datasets that produced no chunks still get an (empty) shard
+    for name in metadata.get("processed_datasets", []):
+        shard_path(output_dir, name).touch()
+
+    metadata["total_chunks"] = total_chunks
+    metadata["total_words"] = total_words
+    save_checkpoint(output_dir, metadata)
+    legacy_file.unlink()
+
+
+def load_checkpoint(output_dir: Path) -> Tuple[int, int, dict, set]:
+    """
+    Load checkpoint if exists.
+
+    Returns (total_chunks, total_words, metadata, processed_datasets), with
+    the totals taken from the metadata.
+    """
+    convert_legacy_checkpoint(output_dir)
+    metadata_file = output_dir / "checkpoint_meta.json"
+
+    if not metadata_file.exists():
+        return 0, 0, {}, set()
 
-    with open(metadata_file) as f:
-        metadata = json.load(f)
+    with open(metadata_file, "rb") as f:
+        metadata = loads_json(f.read())
 
     processed = set(metadata.get("processed_datasets", []))
-    return chunks, metadata, processed
+    if not all(
+        shard_path(output_dir, c.name).exists() for c in DATASET_CONFIGS if c.name in processed
+    ):
+        return 0, 0, {}, set()
+
+    return (
+        metadata.get("total_chunks", 0),
+        metadata.get("total_words", 0),
+        metadata,
+        processed,
+    )
 
 
 def prepare_huggingface_benchmark(
@@ -303,12 +814,33 @@ def prepare_huggingface_benchmark(
     overlap: int = 50,
     datasets: Optional[List[str]] = None,
     resume: bool = True,
+    compress: bool = False,
+    use_cache: bool = True,
+    output_format: str = "json",
 ) -> dict:
     """
     Download and process multiple HuggingFace datasets.
 
+    With compress, chunks are written to chunks.jsonl.zst instead of
+    chunks.jsonl; with output_format "parquet", to chunks.parquet. With
+    use_cache, streamed documents are kept under output_dir/.hf_cache and
+    reused by later runs.
     Returns statistics about the processed data.
     """
+    if compress and zstd is None:
+        print("Error: --compress requires the zstandard package")
+        print("Install with: pip install zstandard")
+        sys.exit(1)
+    if output_format == "parquet":
+        if compress:
+            print("Error: --compress only applies to JSON output")
+            print("Parquet output is always zstd-compressed")
+            sys.exit(1)
+        if pa is None:
+            print("Error: --format parquet requires the pyarrow package")
+            print("Install with: pip install pyarrow")
+            sys.exit(1)
+
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -332,33 +864,39 @@ def prepare_huggingface_benchmark(
             sys.exit(1)
 
     # Load checkpoint if resuming
-    all_chunks = []
-    topic_counts: Dict[str, int] = {}
+    topic_counts: Counter = Counter()
     processed_datasets: set = set()
+    total_chunks = 0
+    total_words = 0
 
     if resume:
-        all_chunks, checkpoint_meta, processed_datasets = load_checkpoint(output_dir)
-        if all_chunks:
-            print(f"✓ Resuming from checkpoint: {len(all_chunks)} chunks")
-            topic_counts = checkpoint_meta.get("topic_counts", {})
+        total_chunks, total_words, checkpoint_meta, processed_datasets = load_checkpoint(
+            output_dir
+        )
+        if checkpoint_meta:
+            print(f"✓ Resuming from checkpoint: {total_chunks} chunks")
+            topic_counts = Counter(checkpoint_meta.get("topic_counts", {}))
 
     # Calculate per-dataset limits
     remaining_configs = [c for c in configs if c.name not in processed_datasets]
     if not remaining_configs:
         print("All datasets already processed!")
     else:
-        chunks_remaining = max_chunks - len(all_chunks)
+        # A resume with a smaller --max-chunks than already produced adds nothing
+        chunks_remaining = max(max_chunks - total_chunks, 0)
         per_dataset_limit = chunks_remaining // len(remaining_configs)
 
-        # Adjust max_docs based on average chunks per doc (~2-3)
+        # Adjust max_docs based on average chunks per doc (~2-3). Datasets run
+        # concurrently, so each also gets its own share of the chunk budget.
         for config in remaining_configs:
             config.max_docs = min(config.max_docs, per_dataset_limit // 2)
+            config.max_chunks = per_dataset_limit
 
     # Overall statistics
     stats = {
         "total_documents": 0,
-        "total_chunks": len(all_chunks),
-        "total_words": sum(c.get("word_count", 0) for c in all_chunks),
+        "total_chunks": total_chunks,
+        "total_words": total_words,
         "chunk_size": chunk_size,
         "overlap": overlap,
         "source_datasets": [],
@@ -367,64 +905,109 @@ def prepare_huggingface_benchmark(
         "top_topics": [],
     }
 
-    # Calculate total docs for progress bar
-    total_docs = sum(c.max_docs for c in remaining_configs)
-
     print(f"\nProcessing {len(remaining_configs)} datasets...")
     print(f"  Target: {max_chunks} total chunks")
     print(f"  Chunk size: {chunk_size} words, overlap: {overlap}")
     print()
 
-    with tqdm(total=total_docs, desc="Downloading", unit="docs") as pbar:
-        for config in remaining_configs:
-            if len(all_chunks) >= max_chunks:
-                break
-
-            dataset_stats = process_dataset(
-                config=config,
-                output_chunks=all_chunks,
-                topic_counts=topic_counts,
-                pbar=pbar,
-                chunk_size=chunk_size,
-                overlap=overlap,
-            )
-
-            stats["dataset_stats"][config.name] = dataset_stats
-            stats["source_datasets"].append(config.name)
-            stats["total_documents"] += dataset_stats["documents"]
-            stats["total_chunks"] = len(all_chunks)
-            stats["total_words"] += dataset_stats["words"]
-
-            processed_datasets.add(config.name)
-
-            # Save checkpoint after each dataset
-            checkpoint_meta = {
-                "processed_datasets": list(processed_datasets),
-                "topic_counts": topic_counts,
-            }
-            save_checkpoint(output_dir, all_chunks, checkpoint_meta)
-
-            print(f"\n  ✓ {config.name}: {dataset_stats['documents']} docs, {dataset_stats['chunks']} chunks")
+    # One worker per dataset so downloads overlap. Workers inherit HF_TOKEN
+    # through the environment and do not log in themselves.
+    results: Dict[str, Dict[str, int]] = {}
+    results_topics: Dict[str, Counter] = {}
+    checkpoint_chunks = total_chunks
+    checkpoint_words = total_words
+    if remaining_configs:
+        cache_dir = output_dir / DOC_CACHE_DIR if use_cache else None
+        worker_args = [
+            (config, output_dir, position, chunk_size, overlap, cache_dir)
+            for position, config in enumerate(remaining_configs)
+        ]
+        with Pool(
+            len(remaining_configs),
+            initializer=init_worker,
+            initargs=(tqdm.get_lock(),),
+        ) as pool:
+            # A failing dataset must not discard the others: keep collecting
+            # (and checkpointing) results, and re-raise once all have finished
+            error: Optional[Exception] = None
+            pending = pool.imap_unordered(process_dataset_worker, worker_args)
+            for _ in worker_args:
+                try:
+                    name, dataset_stats, dataset_topics = next(pending)
+                except Exception as e:
+                    print(f"\n  ✗ Dataset failed: {e!r}")
+                    if error is None:
+                        error = e
+                    continue
+
+                results[name] = dataset_stats
+                results_topics[name] = dataset_topics
+
+                processed_datasets.add(name)
+                checkpoint_chunks += dataset_stats["chunks"]
+                checkpoint_words += dataset_stats["words"]
+
+                # Save checkpoint after each dataset
+                checkpoint_meta = {
+                    "processed_datasets": list(processed_datasets),
+                    "topic_counts": merge_topic_counts(
+                        topic_counts, remaining_configs, results_topics
+                    ),
+                    "total_chunks": checkpoint_chunks,
+                    "total_words": checkpoint_words,
+                }
+                save_checkpoint(output_dir, checkpoint_meta)
+
+                print(f"\n  ✓ {name}: {dataset_stats['documents']} docs, {dataset_stats['chunks']} chunks")
+
+        if error is not None:
+            raise error
+
+    # Aggregate in config order so output is independent of completion order
+    topic_counts = merge_topic_counts(topic_counts, remaining_configs, results_topics)
+    for config in remaining_configs:
+        dataset_stats = results[config.name]
+        stats["dataset_stats"][config.name] = dataset_stats
+        stats["source_datasets"].append(config.name)
+        stats["total_documents"] += dataset_stats["documents"]
+        stats["total_chunks"] += dataset_stats["chunks"]
+        stats["total_words"] += dataset_stats["words"]
 
     # Compute top topics
-    sorted_topics = sorted(topic_counts.items(), key=lambda x: -x[1])[:100]
+    sorted_topics = topic_counts.most_common(100)
     stats["top_topics"] = [t[0] for t in sorted_topics]
     stats["topic_counts"] = dict(sorted_topics)
 
     # Save final output
-    chunks_file = output_dir / "chunks.jsonl"
+    if output_format == "parquet":
+        chunks_file = output_dir / "chunks.parquet"
+    else:
+        chunks_file = output_dir / ("chunks.jsonl.zst" if compress else "chunks.jsonl")
     metadata_file = output_dir / "metadata.json"
+    shards = [
+        shard_path(output_dir, config.name)
+        for config in DATASET_CONFIGS
+        if config.name in processed_datasets
+    ]
+
+    print(f"\nWriting {stats['total_chunks']} chunks to {chunks_file}...")
+    if output_format == "parquet":
+        write_parquet(shards, chunks_file)
+    else:
+        with open_output(chunks_file, compress) as out:
+            for shard in shards:
+                with open(shard, "rb") as f:
+                    shutil.copyfileobj(f, out)
 
-    print(f"\nWriting {len(all_chunks)} chunks to {chunks_file}...")
-    with open(chunks_file, "w") as f:
-        for chunk in all_chunks:
-            f.write(json.dumps(chunk) + "\n")
-
-    with open(metadata_file, "w") as f:
-        json.dump(stats, f, indent=2)
+    with open(metadata_file, "wb") as f:
+        f.write(dumps_pretty(stats))
 
     # Clean up checkpoint
-    checkpoint_file = output_dir / "checkpoint.jsonl"
+    for config in DATASET_CONFIGS:
+        shard = shard_path(output_dir, config.name)
+        if shard.exists():
+            shard.unlink()
+    checkpoint_file = output_dir / "checkpoint.jsonl"  # Left by --no-resume runs
     checkpoint_meta = output_dir / "checkpoint_meta.json"
     if checkpoint_file.exists():
         checkpoint_file.unlink()
@@ -498,6 +1081,24 @@ def main():
         action="store_true",
         help="Don't resume from checkpoint, start fresh",
     )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Write chunks.jsonl.zst (zstd) instead of chunks.jsonl; "
+        "decompress with 'zstd -d' before loading in the Rust benchmark",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "parquet"],
+        default="json",
+        help="Chunk output format: chunks.jsonl (default, read by the Rust "
+        "benchmark) or chunks.parquet with dictionary-encoded string columns",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always stream from HuggingFace, ignoring the local document cache",
+    )
     parser.add_argument(
         "--list-datasets",
         action="store_true",
@@ -524,6 +1125,9 @@ def main():
         overlap=args.overlap,
         datasets=args.datasets,
         resume=not args.no_resume,
+        compress=args.compress,
+        use_cache=not args.no_cache,
+        output_format=args.format,
     )
 
 